@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:48:53 2026
+"""
+
+#############################################################################
+#                       CAPACITY PROJECTION
+#
+# Projection of the telescope time requested by the survey TargetList from
+# each telescope of the network, night by night over a given date range
+#############################################################################
+
+import numpy as np
+from datetime import datetime, timedelta
+from sys import argv, exit
+import instruments
+
+def get_field_arrays( fields, config ):
+    """Function to extract the parameters of the observation requests for a
+    list of SurveyFields as arrays.  Returns the list of telescopes as
+    (site, observatory, tel_class) tuples, the index of each field's
+    telescope, the telescope time requested per window in seconds, and the
+    interval between the starts of successive windows in seconds.
+    """
+
+    telescopes = {}
+    overheads = {}
+    tel_index = []
+    inst_index = []
+    nexposures = []
+    exptimes = []
+    counts = []
+    cadence = []
+
+    for field in fields:
+        tel_class = str(field.tel).lower().replace('a','')
+        telescope = ( str(field.site), str(field.observatory), tel_class )
+        if telescope not in telescopes:
+            telescopes[telescope] = len(telescopes)
+        tel_index.append( telescopes[telescope] )
+
+        instrument = ( tel_class, instruments.get_instrument_class( field.instrument ) )
+        if instrument not in overheads:
+            overheads[instrument] = len(overheads)
+        inst_index.append( overheads[instrument] )
+
+        nexposures.append( len(field.exposure_times) )
+        exptimes.extend( field.exposure_times )
+        counts.extend( field.exposure_counts )
+        cadence.append( float(field.cadence) )
+
+    # Overheads for each unique telescope and instrument combination:
+    padding = np.zeros( len(overheads) )
+    readout = np.zeros( len(overheads) )
+    for (tel_class, instrument_class), i in overheads.items():
+        imager = instruments.Instrument( tel_class, instrument_class )
+        padding[i] = imager.front_padding + imager.filter_change
+        readout[i] = imager.readout
+
+    # Length of each molecule, as for Instrument.calc_group_length,
+    # summed for each field:
+    nexposures = np.array( nexposures, dtype=int )
+    field_index = np.repeat( np.arange( len(nexposures) ), nexposures )
+    exp_inst = np.array( inst_index, dtype=int )[field_index]
+    molecule_length = padding[exp_inst] + \
+            np.array(counts) * ( np.array(exptimes) + readout[exp_inst] )
+    group_length = np.bincount( field_index, weights=molecule_length, \
+                                minlength=len(nexposures) )
+
+    # Successive windows are separated, as in build_odin_request, by the
+    # length of the last molecule, the request window and the cadence:
+    window = float(config['request_window']) * 60.0 * 60.0
+    last_molecule = molecule_length[ np.cumsum(nexposures) - 1 ]
+    interval = last_molecule + window + \
+                ( np.array(cadence) * 24.0 * 60.0 * 60.0 )
+
+    telescope_list = sorted( telescopes.keys(), key=lambda t: telescopes[t] )
+    return ( telescope_list, np.array( tel_index, dtype=int ),
+                group_length, interval )
+
+def project_requested_hours( fields, config, start_date, end_date,
+                                chunk_size=10000 ):
+    """Function to project the telescope time requested by a list of
+    SurveyFields from each telescope, for each night from start_date to
+    end_date inclusive.  Nights are counted as UTC days, and each field is
+    assumed to be observed continuously at its cadence from the start of
+    the date range, with the windows generated by build_odin_request.
+    Returns the list of telescopes, the list of dates of each night, and
+    an array of the hours requested from each telescope on each night.
+    """
+
+    (telescopes, tel_index, group_length, interval) = \
+                                    get_field_arrays( fields, config )
+
+    nnights = ( end_date - start_date ).days + 1
+    nights = [ start_date + timedelta(days=i) for i in range(nnights) ]
+    night_edges = np.arange( nnights + 1 ) * 24.0 * 60.0 * 60.0
+
+    # The number of windows starting before each night boundary is
+    # ceil( t / interval ), so the number starting during each night is
+    # the difference between successive boundaries.  Fields are processed
+    # in chunks to limit the size of the fields x nights arrays:
+    hours = np.zeros( ( len(telescopes), nnights ) )
+    telescope_ids = np.arange( len(telescopes) )
+    for i in range( 0, len(tel_index), chunk_size ):
+        nwindows = np.ceil( night_edges[np.newaxis,:] / \
+                            interval[i:i+chunk_size,np.newaxis] )
+        field_hours = np.diff( nwindows, axis=1 ) * \
+                    group_length[i:i+chunk_size,np.newaxis] / ( 60.0 * 60.0 )
+        assignment = ( telescope_ids[:,np.newaxis] == \
+                        tel_index[np.newaxis,i:i+chunk_size] ).astype(float)
+        hours = hours + np.dot( assignment, field_hours )
+
+    return telescopes, nights, hours
+
+def find_oversubscribed( telescopes, nights, hours, capacity ):
+    """Function to identify the nights on which the time requested from a
+    telescope exceeds its capacity in hours.  Returns a list of
+    (telescope, night, hours) tuples."""
+
+    oversubscribed = []
+    (itel, inight) = np.nonzero( hours > capacity )
+    for i,j in zip( itel, inight ):
+        oversubscribed.append( ( telescopes[i], nights[j], hours[i,j] ) )
+    return oversubscribed
+
+###############################################
+# COMMANDLINE SECTION
+if __name__ == '__main__':
+
+    import config_parser
+    import log_utilities
+    import sinistro_survey
+    import site_planner
+    import target_validation
+
+    usage = 'Usage: python capacity.py start_date end_date (YYYY-MM-DD), ' + \
+            'where end_date is not before start_date'
+    try:
+        start_date = datetime.strptime( argv[1], '%Y-%m-%d' )
+        end_date = datetime.strptime( argv[2], '%Y-%m-%d' )
+    except (IndexError, ValueError):
+        print usage
+        exit()
+    if end_date < start_date:
+        print usage
+        exit()
+
+    (iexec, script_config) = config_parser.readxmlconfig('survey_config.xml','.survey')
+    log = log_utilities.start_day_log( script_config, 'sinistro_survey_capacity' )
+
+    # The TargetList is validated as for a survey run:
+    target_list = sinistro_survey.open_target_list( script_config, log )
+    (errors, warnings) = target_validation.validate_target_lines( target_list, \
+                                                            script_config )
+    target_list.close()
+    if len(errors) > 0:
+        print str(len(errors)) + ' errors found in the TargetList:'
+        for message in errors:
+            print message
+        log_utilities.end_day_log( log )
+        exit()
+
+    # Fields for which no telescope is available would not be requested:
+    fields = list( sinistro_survey.iter_target_list( script_config, log ) )
+    planner = site_planner.SitePlanner( script_config )
+    unassigned = planner.plan( fields, log=log )
+    if len(unassigned) > 0:
+        excluded = set( [ field.name for field in unassigned ] )
+        fields = [ field for field in fields if field.name not in excluded ]
+        print str(len(unassigned)) + ' fields excluded, with no telescope available'
+
+    (telescopes, nights, hours) = project_requested_hours( fields, \
+                                        script_config, start_date, end_date )
+    capacity = float(script_config.get('night_capacity_hours', 10.0))
+    oversubscribed = find_oversubscribed( telescopes, nights, hours, capacity )
+
+    print 'Requested hours, ' + argv[1] + ' to ' + argv[2] + ':'
+    for i,telescope in enumerate(telescopes):
+        print ':'.join(telescope), round(hours[i,:].sum(),2), \
+            'total,', round(hours[i,:].max(),2), 'max per night'
+    print str(len(oversubscribed)) + ' nights oversubscribed beyond ' + \
+            str(capacity) + 'hrs:'
+    for (telescope, night, night_hours) in oversubscribed:
+        print ':'.join(telescope), night.strftime('%Y-%m-%d'), round(night_hours,2)
+
+    log_utilities.end_day_log( log )
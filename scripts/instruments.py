@@ -5,9 +5,58 @@ Created on Thu Mar 17 10:09:42 2016
 @author: rstreet
 """
 
+# Overheads, in seconds, for each class of instrument available on each 
+# class of telescope in the network:
+NETWORK_OVERHEADS = { 
+            '1m0a':   {
+                    'sinistro': { 'front_padding': 240.0, 
+                                  'filter_change': 2.0,
+                                  'readout': 38.0
+                                 },
+                    'sbig':     { 'front_padding': 90.0, 
+                                  'filter_change': 2.0,
+                                  'readout': 15.5
+                                }
+                    },
+            '2m0a':   {
+                    'spectral': { 'front_padding': 240.0, 
+                                  'filter_change': 2.0,
+                                  'readout': ( (42.0/4.0) + 12.0 )                                         }
+                    }
+            }
+
+def get_instrument_class( camera ):
+    """Function to return the class of instrument of a given camera.  The
+    class itself, as recorded in the survey logs, may also be given."""
+    
+    camera = str(camera).lower()
+    if camera in [ 'sinistro', 'sbig', 'spectral' ]:
+        instrument_class = camera
+    elif 'fl' in camera: 
+        instrument_class = 'sinistro'
+    elif 'kb' in camera:
+        instrument_class = 'sbig'
+    elif 'fs' in camera:
+        instrument_class = 'spectral'
+    else:
+        instrument_class = 'unknown'
+    return instrument_class
+
+def is_known_instrument( tel, camera ):
+    """Function to determine whether overheads are known for a given 
+    combination of telescope and camera"""
+    
+    tel = str(tel).lower().replace('a','') + 'a'
+    if tel in NETWORK_OVERHEADS and \
+        get_instrument_class( camera ) in NETWORK_OVERHEADS[tel]:
+        return True
+    return False
+
 class Instrument:
     """Class describing the overheads attributed to using different classes
-    of instruments on the LCOGT network"""    
+    of instruments on the LCOGT network.  The telescope and camera may also
+    be given by their classes, as recorded in the survey logs, e.g. 1m0 and 
+    sinistro."""    
     
     def __init__(self, tel, camera):
         tel = str(tel).lower()
@@ -19,36 +68,11 @@ class Instrument:
         self.filter_change = 2.0
         self.readout = 30.0
         
-        if 'fl' in self.instrument_name: 
-            self.instrument_class = 'sinistro'
-        elif 'kb' in self.instrument_name:
-            self.instrument_class = 'sbig'
-        elif 'fs' in self.instrument_name:
-            self.instrument_class = 'spectral'
-        else:
-            self.instrument_class = 'unknown'
+        self.instrument_class = get_instrument_class( camera )
         self.instrument = tel.replace('a','') + '-SCICAM-' + \
                                 str(self.instrument_class).upper()
         
-        network_overheads = { 
-                    '1m0a':   {
-                            'sinistro': { 'front_padding': 240.0, 
-                                          'filter_change': 2.0,
-                                          'readout': 38.0
-                                         },
-                            'sbig':     { 'front_padding': 90.0, 
-                                          'filter_change': 2.0,
-                                          'readout': 15.5
-                                        }
-                            },
-                    '2m0a':   {
-                            'spectral': { 'front_padding': 240.0, 
-                                          'filter_change': 2.0,
-                                          'readout': ( (42.0/4.0) + 12.0 )                                         }
-                            }
-                    }
-        
-        overheads = network_overheads[tel][self.instrument_class]
+        overheads = NETWORK_OVERHEADS[tel.replace('a','')+'a'][self.instrument_class]
         self.front_padding = overheads['front_padding']
         self.filter_change = overheads['filter_change']
         self.readout = overheads['readout']
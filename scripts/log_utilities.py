@@ -10,11 +10,13 @@ Created on Wed Feb 17 00:00:05 2016
 #############################################################################
 
 import logging
-from os import path
+import os
+from os import path, rename, remove, fsync
 from astropy.time import Time, TimeDelta
 import glob
 from datetime import datetime
 import survey_classes
+import scheduler_api
 
 def get_log_path( log_dir, log_root_name, day_offset=None ):
     """Function to return the full path to a timestamped day log"""
@@ -96,56 +98,228 @@ def start_obs_record( config ):
         obsrecord.write('# GrpID  TrackID  ReqID  Network  Site  Obs  Tel  Instrum  Target  RA(J2000)  Dec(J2000)  Filter  ExpTime  ExpCount  ExpTaken  GrpType  Cadence  Priority  TS_Submit  TS_Expire  TAGID  UserID  PropID  TTL  Twilight  Darkness  Seeing  FocusOffset  RotatorAngle  Autoguider  SubmitMech  ConfigType  ReqOrigin  RCS_Report\n')
     return obsrecord
 
-def read_active_survey_obs( config, log ):
-    """Function to read the ActiveSurveyObs.log file"""
+def iter_active_survey_obs( config, log ):
+    """Generator function to read the ActiveSurveyObs.log file line by line,
+    yielding a SurveyField for each record of a live observation request"""
     
     log_file = path.join( config['logdir'], 'ActiveSurveyObs.log' )
     
-    existing_obs = {}    
+    return iter_obs_log( log_file, config, log )
+
+def iter_obs_log( log_file, config, log ):
+    """Generator function to read a log of observation requests in the
+    standard format line by line, yielding a SurveyField for each record of 
+    a live observation request"""
     
     tnow = datetime.utcnow()
     
     # Case 1: no log file.  Assume no recent observations have been requested
     if path.isfile( log_file ) == False:
         log.info('-> No records of recent observations have been found')
-        return existing_obs
+        return
     
     # Case 2: A log file exists, indicating previous observation groups may
     # still be live.  Note we first filter for those prefixed 'RBNS'
-    else:
-        file_lines = open(log_file, 'r').readlines()
-        log.info('Reading log file ' + path.basename( log_file ))
-        for line in file_lines:
-            if line.lstrip()[0:1] != '#' and len(line) > 0:
-                entries = line.split()
-                if 'RBNS' in entries[0]:
-                    field = survey_classes.SurveyField(config)
+    obs_log = open(log_file, 'r')
+    log.info('Reading log file ' + path.basename( log_file ))
+    for line in obs_log:
+        if line.lstrip()[0:1] != '#' and len(line.strip()) > 0:
+            entries = line.split()
+            if 'RBNS' in entries[0]:
+                # A record cut short, as by an interruption while the 
+                # journal was written, is skipped:
+                field = survey_classes.SurveyField(config)
+                try:
                     field.set_pars_from_log( line )
-                    if field.submit_status == 'add_OK' and \
-                        field.ts_expire > tnow:
-                        existing_obs[field.name] = field
-                        log.info(' -> Found ongoing live obs request for field ' + \
-                                field.name + ': ' + field.req_id + \
-                                '. Expires: ' + \
-                                field.ts_submit.strftime("%Y-%m-%dT%H:%M:%S"))
-        if len(existing_obs) == 0:
-            log.info(' -> No ongoing observations found')
+                except (IndexError, ValueError):
+                    log.info(' -> WARNING: Skipping incomplete record in ' + \
+                            path.basename( log_file ) + ': ' + line.strip())
+                    continue
+                if field.submit_status in scheduler_api.LIVE_STATES and \
+                    field.ts_expire > tnow:
+                    log.info(' -> Found ongoing live obs request for field ' + \
+                            field.name + ': ' + field.req_id + \
+                            '. Expires: ' + \
+                            field.ts_submit.strftime("%Y-%m-%dT%H:%M:%S"))
+                    yield field
+    obs_log.close()
+
+def read_active_survey_obs( config, log ):
+    """Function to read the ActiveSurveyObs.log file"""
+    
+    existing_obs = {}    
+    
+    for field in iter_active_survey_obs( config, log ):
+        existing_obs[field.name] = field
+    if len(existing_obs) == 0:
+        log.info(' -> No ongoing observations found')
             
     return existing_obs
 
-def write_active_survey_obs( existing_obs, config, log ):
-    """Function to write the ActiveSurveyObs log"""
+def start_active_survey_obs( config ):
+    """Function to start a new ActiveSurveyObs log.  The log is written to a
+    temporary file, which replaces the existing log only once it is complete
+    and is closed with close_active_survey_obs.
+    """
     
     log_file = path.join( config['logdir'], 'ActiveSurveyObs.log' )
     tnow = datetime.utcnow()
-    active_log = open( log_file, 'w' )
+    active_log = open( log_file + '.tmp', 'w' )
     active_log.write('# Log of Requested Observation Groups\n')
     active_log.write('#\n')
     active_log.write('# Log started: ' + tnow.strftime("%Y-%m-%dT%H:%M:%S") + '\n')
     active_log.write('# Running at sba\n')
     active_log.write('# GrpID  TrackID  ReqID  Network  Site  Obs  Tel  Instrum  Target  RA(J2000)  Dec(J2000)  Filter  ExpTime  ExpCount  ExpTaken  GrpType  Cadence  Priority  TS_Submit  TS_Expire  TAGID  UserID  PropID  TTL  Twilight  Darkness  Seeing  FocusOffset  RotatorAngle  Autoguider  SubmitMech  ConfigType  ReqOrigin  RCS_Report\n')
+    return active_log
+
+def close_active_survey_obs( active_log, config, log ):
+    """Function to complete a new ActiveSurveyObs log, replacing the 
+    previous version"""
+    
+    log_file = path.join( config['logdir'], 'ActiveSurveyObs.log' )
+    replace_log_file( active_log, log_file )
+    log.info('Completed output of observations to active log')
+
+def replace_log_file( tmp_log, log_file ):
+    """Function to close a completed temporary log file and move it into 
+    place, replacing the previous version of log_file.  The file and the
+    rename are forced to disk, so that the new log survives the process 
+    being interrupted, before any record it supersedes is removed."""
+    
+    tmp_log.flush()
+    fsync( tmp_log.fileno() )
+    tmp_log.close()
+    rename( log_file + '.tmp', log_file )
+    log_dir = os.open( path.dirname( path.abspath( log_file ) ), os.O_RDONLY )
+    try:
+        fsync( log_dir )
+    finally:
+        os.close( log_dir )
+
+def write_active_survey_obs( existing_obs, config, log, finished_obs=[] ):
+    """Function to write the ActiveSurveyObs log.  The final records of any
+    requests found to have finished are written first, if given."""
+    
+    active_log = start_active_survey_obs( config )
+    for field in finished_obs:
+        active_log.write( field.obs_record( config ) )
     for field_id, field in existing_obs.items():
         obsrecord = field.obs_record( config )
         active_log.write( obsrecord )
-    active_log.close()
-    log.info('Completed output of observations to active log')
\ No newline at end of file
+    close_active_survey_obs( active_log, config, log )
+
+def read_deferred_obs( config ):
+    """Function to read the DeferredSurveyObs log of fields which could not
+    be submitted during the previous run, returning a set of field names"""
+    
+    log_file = path.join( config['logdir'], 'DeferredSurveyObs.log' )
+    
+    deferred_obs = set()
+    if path.isfile( log_file ) == True:
+        for line in open( log_file, 'r' ):
+            if line.lstrip()[0:1] != '#' and len(line.strip()) > 0:
+                deferred_obs.add( line.split()[0] )
+    return deferred_obs
+
+def start_deferred_obs( config ):
+    """Function to start a new DeferredSurveyObs log, to which the names of
+    fields which could not be submitted during this run are written.  As for
+    the active log, this replaces the previous version once closed."""
+    
+    log_file = path.join( config['logdir'], 'DeferredSurveyObs.log' )
+    tnow = datetime.utcnow()
+    deferred_log = open( log_file + '.tmp', 'w' )
+    deferred_log.write('# Log of Observation Requests deferred to the next run\n')
+    deferred_log.write('#\n')
+    deferred_log.write('# Log started: ' + tnow.strftime("%Y-%m-%dT%H:%M:%S") + '\n')
+    deferred_log.write('# Target  Reason\n')
+    return deferred_log
+
+def close_deferred_obs( deferred_log, config, log ):
+    """Function to complete a new DeferredSurveyObs log"""
+    
+    log_file = path.join( config['logdir'], 'DeferredSurveyObs.log' )
+    replace_log_file( deferred_log, log_file )
+    log.info('Completed output of deferred observations')
+
+def iter_journal( config, log ):
+    """Function to read the SurveyJournal of submissions made during a 
+    previous run which did not complete, yielding a SurveyField for each 
+    live observation request recorded"""
+    
+    log_file = path.join( config['logdir'], 'SurveyJournal.log' )
+    if path.isfile( log_file ) == True:
+        log.info('Replaying journal of submissions from an interrupted run')
+        for field in iter_obs_log( log_file, config, log ):
+            yield field
+
+def start_journal( config ):
+    """Function to open the SurveyJournal, to which each accepted 
+    submission is written as it is made"""
+    
+    log_file = path.join( config['logdir'], 'SurveyJournal.log' )
+    return open( log_file, 'a' )
+
+def journal_submission( journal, field, config ):
+    """Function to record an accepted submission, or one whose outcome is
+    unknown, in the SurveyJournal.
+    The record is forced to disk before returning, so that it survives
+    the process being interrupted."""
+    
+    if field.submit_status in scheduler_api.LIVE_STATES:
+        journal.write( field.obs_record( config ) )
+        journal.flush()
+        fsync( journal.fileno() )
+
+def clear_journal( journal, config, log ):
+    """Function to remove the SurveyJournal once all of its submissions 
+    have been recorded in the ActiveSurveyObs log"""
+    
+    log_file = path.join( config['logdir'], 'SurveyJournal.log' )
+    journal.close()
+    remove( log_file )
+    log.info('Cleared journal of submissions')
+
+###############################################
+# COMMANDLINE TEST SECTION
+if __name__ == '__main__':
+
+    import shutil
+    import tempfile
+    from datetime import timedelta
+
+    logdir = tempfile.mkdtemp()
+    config = { 'logdir': logdir, 'user_id': 'user', 'proposal_id': 'TEST' }
+    log = logging.getLogger( 'log_utilities' )
+
+    field = survey_classes.SurveyField( config )
+    field.group_id = 'RBNS20261019T16.0'
+    field.name = 'field1'
+    field.req_id = '1000'
+    field.exposure_times = [ 30.0 ]
+    field.exposure_counts = [ 2 ]
+    field.cadence = '0.25'
+    field.ts_submit = datetime.utcnow()
+    field.ts_expire = field.ts_submit + timedelta(days=1)
+    field.submit_status = 'add_OK'
+    record = field.obs_record( config )
+
+    # A journal whose final record was cut short by an interruption is 
+    # replayed up to that record:
+    journal = start_journal( config )
+    journal.write( record )
+    journal.write( record.replace('field1','field2')[0:60] )
+    journal.close()
+    replayed = [ f.name for f in iter_journal( config, log ) ]
+    assert replayed == [ 'field1' ]
+    
+    # As is a record with an invalid timestamp:
+    journal = open( path.join( logdir, 'SurveyJournal.log' ), 'w' )
+    journal.write( record.replace('field1','field2').replace('T','X') )
+    journal.write( record )
+    journal.close()
+    replayed = [ f.name for f in iter_journal( config, log ) ]
+    assert replayed == [ 'field1' ]
+    
+    shutil.rmtree( logdir )
+    print 'Log utilities tests passed'
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:55:36 2026
+"""
+
+#############################################################################
+#                       ODIN STAND-IN SERVER
+#
+# A minimal local stand-in for the ODIN scheduler service, implementing the
+# submit and request status interfaces used by scheduler_api, so that
+# request submission and status synchronisation can be tested without
+# access to the scheduler.  Set odin_server to http://127.0.0.1:<port> in
+# the survey configuration to use it.
+#############################################################################
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import urlparse
+import hashlib
+import json
+import time
+
+class StandinScheduler:
+    """Class describing the state of the stand-in scheduler: the next
+    request number to be issued, and the state and exposures taken of each
+    request, which may be set directly to simulate the progress of requests.
+    Responses to submissions are delayed by submit_delay seconds."""
+
+    def __init__(self, first_request=1000):
+        self.next_request = first_request
+        self.requests = {}
+        self.nsubmissions = 0
+        self.nstatus_queries = 0
+        self.nunchanged = 0
+        self.submit_delay = 0.0
+        self.lock = threading.Lock()
+
+    def add_request(self, state='PENDING', exposures_taken=0):
+        req_id = str(self.next_request)
+        self.next_request += 1
+        self.requests[req_id] = { 'state': state,
+                                  'exposures_taken': exposures_taken }
+        return req_id
+
+    def set_state(self, req_id, state, exposures_taken=None):
+        self.requests[str(req_id)]['state'] = state
+        if exposures_taken != None:
+            self.requests[str(req_id)]['exposures_taken'] = exposures_taken
+
+class StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Request handler for the stand-in scheduler.
+    POST .../submit accepts a request_data parameter holding a single user
+    request, to which it responds {"request_number=N"}, or a list of user
+    requests, to which it responds with a dictionary of "request_number=N"
+    keyed by group_id.
+    GET .../status?request_ids=N,M,... responds with the state and
+    exposures_taken of each request, with an ETag, or with 304 if the
+    If-None-Match header matches it.
+    """
+
+    def do_POST(self):
+        scheduler = self.server.scheduler
+        nbytes = int( self.headers.get('Content-Length', 0) )
+        params = urlparse.parse_qs( self.rfile.read( nbytes ) )
+        if not self.path.endswith('submit') or 'request_data' not in params:
+            self.send_error( 404 )
+            return
+
+        user_requests = json.loads( params['request_data'][0] )
+        scheduler.lock.acquire()
+        if type(user_requests) == type([]):
+            responses = {}
+            for ur in user_requests:
+                responses[ur['group_id']] = 'request_number=' + \
+                                                scheduler.add_request()
+            body = json.dumps( responses )
+        else:
+            body = '{"request_number=' + scheduler.add_request() + '"}'
+        scheduler.nsubmissions += 1
+        scheduler.lock.release()
+        time.sleep( scheduler.submit_delay )
+        self.send_body( 200, body )
+
+    def do_GET(self):
+        scheduler = self.server.scheduler
+        url = urlparse.urlparse( self.path )
+        params = urlparse.parse_qs( url.query )
+        if not url.path.endswith('status') or 'request_ids' not in params:
+            self.send_error( 404 )
+            return
+        if self.headers.get('Authorization','')[0:6] != 'Basic ':
+            self.send_error( 401 )
+            return
+
+        scheduler.lock.acquire()
+        scheduler.nstatus_queries += 1
+        states = {}
+        for req_id in params['request_ids'][0].split(','):
+            if req_id in scheduler.requests:
+                states[req_id] = dict( scheduler.requests[req_id] )
+        scheduler.lock.release()
+
+        body = json.dumps( states, sort_keys=True )
+        etag = '"' + hashlib.md5( body ).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            scheduler.nunchanged += 1
+            self.send_body( 304, '', etag=etag )
+        else:
+            self.send_body( 200, body, etag=etag )
+
+    def send_body(self, status, body, etag=None):
+        self.send_response( status )
+        if etag != None:
+            self.send_header( 'ETag', etag )
+        self.send_header( 'Content-Length', str(len(body)) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message(self, *args):
+        pass
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients which time out close their connection before the response
+        # is written, as expected when testing timeouts:
+        pass
+
+def start_standin( port=0, scheduler=None ):
+    """Function to start the stand-in scheduler on a local port, serving
+    from a background thread.  Returns the server, whose port is given by
+    server.server_address[1] and whose state is server.scheduler."""
+
+    server = StandinServer( ( '127.0.0.1', port ), StandinHandler )
+    if scheduler == None:
+        server.scheduler = StandinScheduler()
+    else:
+        server.scheduler = scheduler
+    thread = threading.Thread( target=server.serve_forever )
+    thread.daemon = True
+    thread.start()
+    return server
+
+###############################################
+# COMMANDLINE TEST SECTION
+if __name__ == '__main__':
+
+    import logging
+    import shutil
+    import tempfile
+    from os import path
+    import scheduler_api
+    import survey_classes
+
+    server = start_standin()
+    scheduler = server.scheduler
+    logdir = tempfile.mkdtemp()
+    config = { 'logdir': logdir, 'simulate': 'false',
+              'user_id': 'user', 'odin_access': 'password',
+              'proposal_id': 'TEST',
+              'odin_server': 'http://127.0.0.1:' + str(server.server_address[1]),
+              'status_batch_size': '5' }
+    log = logging.getLogger( 'odin_standin' )
+
+    fields = []
+    for i in range(12):
+        field = survey_classes.SurveyField( config )
+        field.name = 'field' + str(i)
+        field.req_id = scheduler.add_request()
+        field.submit_status = 'add_OK'
+        fields.append( field )
+
+    # First synchronisation: all requests pending, one query per batch:
+    nfinished = scheduler_api.sync_request_status( fields, config, log )
+    assert nfinished == 0
+    nqueries = scheduler.nstatus_queries
+    assert path.isfile( path.join( logdir, 'RequestStatusCache.json' ) )
+
+    # Second synchronisation, after one request has completed and another
+    # taken exposures.  Only their batches have changed, so the other
+    # returns 304 and its cached status is used:
+    scheduler.set_state( fields[0].req_id, 'COMPLETED', exposures_taken=3 )
+    scheduler.set_state( fields[11].req_id, 'PENDING', exposures_taken=1 )
+    nfinished = scheduler_api.sync_request_status( fields, config, log )
+    assert nfinished == 1
+    assert scheduler.nstatus_queries == 2 * nqueries
+    assert scheduler.nunchanged == 1
+    assert fields[0].submit_status == 'COMPLETED'
+    assert fields[0].exposures_taken == 3
+    assert fields[11].submit_status == 'add_OK'
+    assert fields[11].exposures_taken == 1
+
+    # Requests cancelled or expired are also recorded as finished.  Those
+    # already finished are not queried again:
+    scheduler.set_state( fields[5].req_id, 'CANCELLED' )
+    scheduler.set_state( fields[6].req_id, 'EXPIRED' )
+    nfinished = scheduler_api.sync_request_status( fields, config, log )
+    assert nfinished == 2
+    assert fields[5].submit_status == 'CANCELED'
+    assert fields[6].submit_status == 'EXPIRED'
+
+    # A shared cache is written only by its owner:
+    cache = scheduler_api.StatusCache( config )
+    scheduler_api.sync_request_status( fields[0:6], config, log, cache=cache )
+    scheduler_api.sync_request_status( fields[6:], config, log, cache=cache )
+    cache.write()
+    assert sorted( cache.current.keys() ) == \
+        sorted( scheduler_api.StatusCache( config ).previous.keys() )
+
+    # Submission of a batch of requests:
+    for field in fields[0:3]:
+        field.group_id = 'RBNS' + field.name
+        field.json_request = json.dumps( { 'group_id': field.group_id } )
+    scheduler_api.submit_batch( fields[0:3], config, log )
+    for field in fields[0:3]:
+        assert field.submit_status == 'add_OK'
+    assert len( set( [ field.req_id for field in fields[0:3] ] ) ) == 3
+
+    # A submission accepted by the scheduler but whose response times out 
+    # has an unknown outcome, and is held rather than resubmitted:
+    scheduler.submit_delay = 1.0
+    config['read_timeout'] = '0.2'
+    nrequests = len( scheduler.requests )
+    field = fields[3]
+    field.group_id = 'RBNS' + field.name
+    field.json_request = json.dumps( { 'group_id': field.group_id } )
+    field.submit_request( config, log=log, budget=scheduler_api.RunBudget(config) )
+    assert field.submit_status == 'SUBMIT_UNKNOWN'
+    assert len( scheduler.requests ) == nrequests + 1
+    scheduler_api.submit_batch( fields[0:3], config, log )
+    for field in fields[0:3]:
+        assert field.submit_status == 'SUBMIT_UNKNOWN'
+    scheduler.submit_delay = 0.0
+
+    server.shutdown()
+    server.server_close()
+    
+    # Whereas one which fails to connect was not submitted:
+    field.submit_request( config, log=log, budget=scheduler_api.RunBudget(config) )
+    assert field.submit_status == 'NOT_SUBMITTED'
+    
+    shutil.rmtree( logdir )
+    print 'Stand-in scheduler tests passed'
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:40:24 2026
+"""
+
+#############################################################################
+#                       SCHEDULER API
+#
+# Functions to communicate with the LCOGT ODIN scheduler service
+#
+# Request status is queried from the odin_status_url (default
+# /observe/service/request/status) by an HTTP GET, with parameters:
+#   proposal      the proposal_id
+#   request_ids   comma-separated list of req_ids
+# authenticated by HTTP Basic authorization with the user_id and
+# odin_access.  The response body is a JSON object giving the status of
+# each request:
+#   { "<req_id>": { "state": "PENDING", "exposures_taken": 2 }, ... }
+# where state is one of PENDING, COMPLETED, CANCELED or EXPIRED.  If the
+# response carries an ETag, it is sent back as If-None-Match the next time
+# the same batch is queried, and a 304 response means the cached body
+# still applies.  odin_standin.py implements this interface for testing.
+#############################################################################
+
+import httplib
+import urllib
+import urlparse
+import socket
+import base64
+import json
+import time
+import numpy as np
+from os import path
+
+# Request states reported by the scheduler which indicate that a request
+# will receive no further observations, and the corresponding status
+# recorded in the survey logs:
+FINISHED_STATES = { 'COMPLETED': 'COMPLETED',
+                    'CANCELED':  'CANCELED',
+                    'CANCELLED': 'CANCELED',
+                    'EXPIRED':   'EXPIRED'
+                    }
+
+# Submission status of requests which are treated as live.  A request 
+# whose submission failed after it was sent may have been accepted by the
+# scheduler, so it is recorded as SUBMIT_UNKNOWN and held, as if live, until
+# it would have expired, rather than being submitted again:
+LIVE_STATES = [ 'add_OK', 'SUBMIT_UNKNOWN' ]
+
+class SubmitOutcomeUnknown(Exception):
+    """Exception raised when a submission fails after the request was sent,
+    so that it is not known whether the scheduler accepted it"""
+    pass
+
+class RunBudget:
+    """Class describing the time budget allowed for a single run of the 
+    survey, and the deadlines applied to each network call within it.
+    The connect_timeout, read_timeout and run_time_budget configuration
+    parameters are given in seconds.
+    """
+    
+    def __init__(self, config):
+        self.connect_timeout = float(config.get('connect_timeout', 10.0))
+        self.read_timeout = float(config.get('read_timeout', 60.0))
+        self.run_time_budget = float(config.get('run_time_budget', 1800.0))
+        self.ts_start = time.time()
+        self.deadline = self.ts_start + self.run_time_budget
+        self.latencies = []
+    
+    def remaining(self):
+        return self.deadline - time.time()
+    
+    def expired(self):
+        return self.remaining() <= 0.0
+    
+    def get_timeouts(self):
+        """Method to return the (connect, read) timeouts for a network 
+        call, limited by the time remaining in the run"""
+        
+        remaining = max( self.remaining(), 0.001 )
+        return ( min(self.connect_timeout, remaining), 
+                 min(self.read_timeout, remaining) )
+    
+    def record_latency(self, latency):
+        self.latencies.append( latency )
+    
+    def latency_summary(self):
+        if len(self.latencies) == 0:
+            return 'No submissions made'
+        (p50, p95, p99) = np.percentile( np.array(self.latencies), \
+                                            [ 50.0, 95.0, 99.0 ] )
+        output = 'Submit latency over ' + str(len(self.latencies)) + \
+                    ' submissions: p50=' + str(round(p50,3)) + \
+                    's, p95=' + str(round(p95,3)) + \
+                    's, p99=' + str(round(p99,3)) + 's'
+        return output
+
+def get_connection( config, budget=None ):
+    """Function to open a connection to the ODIN server.  The server is
+    given by the optional odin_server configuration parameter, which
+    defaults to https://lcogt.net.  An http:// URL may be given in order to
+    test against a local stand-in server.
+    If a RunBudget is given, the connection is opened with its connect 
+    timeout, and subsequent reads are subject to its read timeout."""
+
+    if budget == None:
+        budget = RunBudget( config )
+    (connect_timeout, read_timeout) = budget.get_timeouts()
+    
+    server = urlparse.urlparse( str(config.get('odin_server', \
+                                                'https://lcogt.net')) )
+    if server.scheme == 'http':
+        connection = httplib.HTTPConnection( server.netloc, \
+                                            timeout=connect_timeout )
+    else:
+        connection = httplib.HTTPSConnection( server.netloc, \
+                                            timeout=connect_timeout )
+    connection.connect()
+    connection.sock.settimeout( read_timeout )
+    return connection
+
+def post_submission( params, config, budget=None ):
+    """Function to post the parameters of an observation request submission
+    to the scheduler, returning the response string.  Network errors and
+    timeouts while connecting are raised to the caller.  Those which occur
+    once the connection is open, including read timeouts, are raised as
+    SubmitOutcomeUnknown."""
+    
+    url_request = urllib.urlencode(params)
+    headers = {'Content-type': 'application/x-www-form-urlencoded'}
+    
+    secure_connect = get_connection( config, budget=budget )
+    try:
+        secure_connect.request("POST", "/observe/service/request/submit", 
+                                   url_request, headers)
+        submit_string = secure_connect.getresponse().read()	
+    except (socket.error, httplib.HTTPException) as err:
+        raise SubmitOutcomeUnknown( 'Network error after request sent: ' + \
+                                    repr(err) )
+    finally:
+        secure_connect.close()
+    
+    return submit_string
+
+def submit_batch( fields, config, log, budget=None ):
+    """Function to submit the observation requests for a list of fields in
+    a single call to the scheduler.  The request_data is sent as a JSON list 
+    of the compound requests for each field.  The scheduler is expected to
+    respond with a JSON object giving the response for each group_id (or a 
+    JSON list of responses in the order submitted), each of which is parsed 
+    as for a single submission.  A failure which applies to the whole batch,
+    such as an authorization failure, is recorded for all of the fields.
+    Any other response, including a list of the wrong length, is not 
+    recognised.  As the scheduler may have accepted the requests, their 
+    fields are marked SUBMIT_UNKNOWN rather than being resubmitted, and 
+    the response is logged so that they can be reconciled.
+    """
+    
+    params = {'username': config['user_id'] ,
+              'password': config['odin_access'], 
+              'proposal': config['proposal_id'], 
+              'request_data' : '[' + \
+                    ','.join( [ field.json_request for field in fields ] ) + ']' }
+    
+    if str(config['simulate']).lower() == 'true':
+        for field in fields:
+            field.submit_status = 'SIM_add_OK'
+            field.submit_response = 'Simulated'
+        log.info(' -> IN SIMULATION MODE: SIM_add_OK for batch of ' + \
+                    str(len(fields)) + ' requests')
+        return
+    
+    ts_start = time.time()
+    try:
+        submit_string = post_submission( params, config, budget=budget )
+    except (socket.error, httplib.HTTPException) as err:
+        for field in fields:
+            field.submit_status = 'NOT_SUBMITTED'
+            field.submit_response = 'Network error: ' + repr(err)
+        log.info(' -> WARNING: Submission of batch failed: ' + repr(err))
+        submit_string = None
+    except SubmitOutcomeUnknown as err:
+        for field in fields:
+            field.submit_status = 'SUBMIT_UNKNOWN'
+            field.submit_response = str(err)
+        log.info(' -> WARNING: Outcome of batch submission unknown, groups ' + \
+                ' '.join( [ str(field.group_id) for field in fields ] ) + \
+                ': ' + str(err))
+        submit_string = None
+    if budget != None:
+        budget.record_latency( time.time() - ts_start )
+    if submit_string == None:
+        return
+    
+    try:
+        responses = json.loads( submit_string )
+    except ValueError:
+        responses = None
+    
+    # Responses given as a list are matched to the fields by position:
+    if type(responses) == type([]) and len(responses) == len(fields):
+        field_responses = zip( fields, responses )
+    elif type(responses) == type({}):
+        field_responses = []
+        for field in fields:
+            field_responses.append( ( field, responses.get( field.group_id ) ) )
+    elif 'Unauthorized' in submit_string or 'time window' in submit_string:
+        field_responses = [ ( field, submit_string ) for field in fields ]
+    else:
+        for field in fields:
+            field.submit_status = 'SUBMIT_UNKNOWN'
+            field.submit_response = 'Unrecognised batch response'
+        log.info(' -> WARNING: Outcome of batch submission unknown, groups ' + \
+                ' '.join( [ str(field.group_id) for field in fields ] ) + \
+                '; unrecognised response: ' + repr(submit_string))
+        return
+    
+    for (field, response) in field_responses:
+        if response == None:
+            field.submit_status = 'WARNING'
+            field.submit_response = 'No response for group in batch submission'
+        else:
+            if type(response) != type(u'') and type(response) != type(''):
+                response = json.dumps( response )
+            field.parse_submit_response( str(response), log=log )
+    log.info(' -> Completed submission of batch of ' + str(len(fields)) + \
+                ' requests')
+
+class RequestBatcher:
+    """Class describing the observation requests waiting to be submitted 
+    to the scheduler.  
+    If the batch_submit configuration parameter is true, the requests for 
+    fields at the same site are held until their total size would exceed 
+    batch_max_bytes, then submitted together.  Otherwise each request is 
+    submitted individually as it is added.  As the responses to a batch are
+    identified by group_id, a field whose group_id is already waiting in 
+    its batch causes the batch to be submitted first.
+    """
+    
+    def __init__(self, config, log, budget):
+        self.config = config
+        self.log = log
+        self.budget = budget
+        self.batch_submit = str(config.get('batch_submit','false')).lower() == 'true'
+        self.batch_max_bytes = int(config.get('batch_max_bytes', 100000))
+        self.batches = {}
+        self.nbytes = {}
+        self.nsubmissions = 0
+        self.nfields = 0
+        self.nnot_submitted = 0
+    
+    def summary(self):
+        output = 'Submitted ' + str(self.nfields) + ' requests in ' + \
+                    str(self.nsubmissions) + ' submissions; ' + \
+                    str(self.nnot_submitted) + ' requests not submitted'
+        return output
+    
+    def submit(self, field):
+        """Method to add a field to be submitted.  Returns the list of 
+        fields which have been submitted as a result."""
+        
+        if self.batch_submit == False:
+            self.submit_fields( [ field ] )
+            return [ field ]
+        
+        key = ( str(field.site), str(field.proposal_id) )
+        size = len(field.json_request)
+        submitted = []
+        if key in self.batches and \
+            ( self.nbytes[key] + size > self.batch_max_bytes or \
+            field.group_id in [ f.group_id for f in self.batches[key] ] ):
+            submitted = self.submit_fields( self.batches.pop(key) )
+        if key not in self.batches:
+            self.batches[key] = []
+            self.nbytes[key] = 0
+        self.batches[key].append( field )
+        self.nbytes[key] = self.nbytes[key] + size
+        return submitted
+    
+    def flush(self):
+        """Method to submit all fields still waiting, returning the list of
+        fields submitted"""
+        
+        submitted = []
+        for key in self.batches.keys():
+            submitted = submitted + self.submit_fields( self.batches.pop(key) )
+        return submitted
+    
+    def submit_fields(self, fields):
+        if self.budget != None and self.budget.expired():
+            for field in fields:
+                field.submit_status = 'NOT_SUBMITTED'
+                field.submit_response = 'Run time budget expired'
+        else:
+            if len(fields) == 1:
+                fields[0].submit_request( self.config, log=self.log, \
+                                        debug=False, budget=self.budget )
+            else:
+                submit_batch( fields, self.config, self.log, budget=self.budget )
+        
+        # Only fields which reached the scheduler are counted as submitted:
+        nsubmitted = 0
+        for field in fields:
+            if field.submit_status != 'NOT_SUBMITTED':
+                nsubmitted += 1
+        if nsubmitted > 0:
+            self.nsubmissions += 1
+        self.nfields = self.nfields + nsubmitted
+        self.nnot_submitted = self.nnot_submitted + len(fields) - nsubmitted
+        return fields
+
+def query_request_status( req_ids, config, etag=None, budget=None ):
+    """Function to query the scheduler for the status of a batch of
+    requests in a single call.  If an ETag from a previous query of the 
+    same batch is given, it is sent as a conditional request.
+    Returns (http_status, etag, response_body), where http_status is 304
+    if the server reports that the status is unchanged.
+    """
+
+    params = {'proposal': config['proposal_id'],
+              'request_ids': ','.join(req_ids) }
+    credentials = base64.b64encode( config['user_id'] + ':' + \
+                                    config['odin_access'] )
+    headers = {'Authorization': 'Basic ' + credentials}
+    if etag != None:
+        headers['If-None-Match'] = etag
+
+    status_url = str(config.get('odin_status_url', \
+                                '/observe/service/request/status'))
+
+    connect = get_connection( config, budget=budget )
+    try:
+        connect.request("GET", status_url + '?' + urllib.urlencode(params), 
+                                                    headers=headers)
+        response = connect.getresponse()
+        body = response.read()
+        new_etag = response.getheader('ETag')
+    finally:
+        connect.close()
+
+    return response.status, new_etag, body
+
+class StatusCache:
+    """Class describing the cache of status responses from the scheduler,
+    used to make conditional requests.  Entries are keyed by batch, and 
+    only those for batches queried during this run are written out."""
+    
+    def __init__(self, config):
+        self.config = config
+        self.cache_file = path.join( config['logdir'], 'RequestStatusCache.json' )
+        self.previous = {}
+        self.current = {}
+        if path.isfile( self.cache_file ) == True:
+            try:
+                self.previous = json.loads( open( self.cache_file, 'r' ).read() )
+            except ValueError:
+                self.previous = {}
+    
+    def get(self, key):
+        if key in self.current:
+            return self.current[key]
+        return self.previous.get( key, None )
+    
+    def set(self, key, entry):
+        if entry != None:
+            self.current[key] = entry
+    
+    def write(self):
+        cache_out = open( self.cache_file, 'w' )
+        cache_out.write( json.dumps( self.current ) )
+        cache_out.close()
+
+def get_status_batch( req_id, batch_size ):
+    """Function to return the batch in which a request's status is queried.
+    Numerical req_ids, as issued by the scheduler, are batched by the range
+    of batch_size IDs into which they fall, so that the batch of each
+    request does not change as other requests are added or removed.  
+    Any other req_ids are queried individually.
+    """
+    
+    req_id = str(req_id)
+    if req_id.isdigit():
+        return 'range' + str( int(req_id) // batch_size )
+    return 'id' + req_id
+
+def get_status_batches( req_ids, batch_size ):
+    """Function to divide a list of req_ids into batches for status queries.
+    Returns a dictionary of lists of req_ids, keyed by batch.
+    """
+    
+    batches = {}
+    for req_id in req_ids:
+        key = get_status_batch( req_id, batch_size )
+        if key not in batches:
+            batches[key] = []
+        batches[key].append( req_id )
+    return batches
+
+def sync_request_status( fields, config, log, budget=None, cache=None ):
+    """Function to update the status of the live observation requests in
+    the list of SurveyFields given, from the status reported by the scheduler.
+    Requests are queried in batches of IDs spanning status_batch_size 
+    (default 50).
+    Fields whose requests have completed, been cancelled or expired have
+    their submit_status set accordingly, so that they can be re-planned.
+    Returns the number of requests found to have finished.
+    If a RunBudget is given, no further queries are made once it expires.
+    A StatusCache may be given where this function is called more than once
+    per run, in which case it is the caller's responsibility to write it.
+    """
+
+    if str(config['simulate']).lower() == 'true':
+        log.info('IN SIMULATION MODE: Skipping request status synchronisation')
+        return 0
+
+    # Each request may be recorded by more than one SurveyField, one per
+    # line of the active log:
+    live_fields = {}
+    for field in fields:
+        if field.submit_status == 'add_OK' and \
+            str(field.req_id) not in [ '', 'None' ]:
+            if str(field.req_id) not in live_fields:
+                live_fields[str(field.req_id)] = []
+            live_fields[str(field.req_id)].append( field )
+    if len(live_fields) == 0:
+        log.info('No live requests for which to synchronise status')
+        return 0
+
+    batch_size = int(config.get('status_batch_size', 50))
+    batches = get_status_batches( live_fields.keys(), batch_size )
+    if cache == None:
+        status_cache = StatusCache( config )
+    else:
+        status_cache = cache
+    nfinished = 0
+
+    log.info('Synchronising status of ' + str(len(live_fields)) + ' requests')
+    for batch_key in sorted( batches.keys() ):
+        # Where the fields given are a subset of those live, as in streaming
+        # mode, a range may be queried in parts, each cached separately:
+        batch = sorted( batches[batch_key] )
+        batch_key = ','.join( batch )
+        cached = status_cache.get( batch_key )
+        if cached != None:
+            etag = cached['etag']
+        else:
+            etag = None
+
+        if budget != None and budget.expired():
+            log.info(' -> WARNING: Run time budget expired; status of ' + \
+                    'remaining requests not synchronised')
+            break
+        
+        # Failed queries retain the cached status of their batch:
+        status_cache.set( batch_key, cached )
+        try:
+            (http_status, etag, body) = query_request_status( batch, config, \
+                                                    etag=etag, budget=budget )
+        except (socket.error, httplib.HTTPException) as err:
+            log.info(' -> WARNING: Status query failed: ' + str(err))
+            continue
+
+        if http_status == 304 and cached != None:
+            body = cached['body']
+            etag = cached['etag']
+            log.info(' -> Status unchanged for batch of ' + str(len(batch)))
+        elif http_status != 200:
+            log.info(' -> WARNING: Status query returned HTTP ' + \
+                                str(http_status))
+            continue
+
+        try:
+            states = json.loads( body )
+        except ValueError:
+            log.info(' -> WARNING: Unable to parse status response: ' + \
+                                str(body))
+            continue
+        if etag != None:
+            status_cache.set( batch_key, { 'etag': etag, 'body': body } )
+
+        for req_id, state in states.items():
+            if str(req_id) not in batch:
+                continue
+            req_state = str(state.get('state','')).upper()
+            for field in live_fields[str(req_id)]:
+                if 'exposures_taken' in state:
+                    field.exposures_taken = int(state['exposures_taken'])
+                if req_state in FINISHED_STATES:
+                    field.submit_status = FINISHED_STATES[req_state]
+                    field.submit_response = 'state=' + req_state
+            if req_state in FINISHED_STATES:
+                nfinished += 1
+                log.info(' -> Request ' + str(req_id) + ' for field ' + \
+                    field.name + ' is ' + req_state + \
+                    ', exposures taken: ' + str(field.exposures_taken))
+
+    if cache == None:
+        status_cache.write()
+    log.info('Completed status synchronisation; ' + str(nfinished) + \
+                ' requests finished')
+
+    return nfinished
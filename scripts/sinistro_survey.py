@@ -15,8 +15,13 @@ Created on Wed Mar 16 14:51:42 2016
 import config_parser
 import log_utilities
 import survey_classes
-from os import path, remove
+import scheduler_api
+import site_planner
+import target_validation
+from os import path, remove, getpid, kill
+import errno
 from datetime import datetime
+from itertools import chain
 
 def run_survey():
     """Driver function for the Sinistro survey package"""
@@ -35,43 +40,241 @@ def run_survey():
     lock( script_config, 'check', log )
     lock( script_config, 'lock', log )
     
+    # Check the whole target list before any observations are requested:
+    check_target_list( script_config, log )
+    
+    # All network calls made during this run are subject to its time budget:
+    budget = scheduler_api.RunBudget( script_config )
+    
+    # Build and submit the observation requests.  In streaming mode the
+    # target list is read and submitted one field at a time, so that memory
+    # use does not grow with the size of the target list:
+    if str(script_config.get('streaming_mode','false')).lower() == 'true':
+        stream_survey( script_config, log, budget )
+    else:
+        submit_survey( script_config, log, budget )
+    log.info( budget.latency_summary() )
+    
+    # Tidy up and finish:
+    log.info('Finished requesting observations')
+    lock( script_config, 'unlock', log )
+    log_utilities.end_day_log( log )
+
+def submit_survey( script_config, log, budget ):
+    """Function to build and submit observation requests for all survey
+    fields which do not already have live requests in the scheduler.
+    Fields deferred from the previous run are submitted first, and any 
+    which cannot be submitted within the run time budget are deferred 
+    to the next run."""
+    
     # Read targetlist and observation configurations
     target_fields = read_target_list( script_config, log )
     
     # Check the logs for any pre-existing and still live obs requests:
     existing_obs = log_utilities.read_active_survey_obs( script_config, log )
     
+    # Include any submissions made by a previous run which was interrupted
+    # before it could record them in the active log:
+    for field in log_utilities.iter_journal( script_config, log ):
+        existing_obs[field.name] = field
+    
+    # Update the status of those requests from the scheduler, so that
+    # fields whose requests have finished can be re-planned:
+    scheduler_api.sync_request_status( existing_obs.values(), script_config, \
+                                        log, budget=budget )
+    # The final records of those requests are kept for the active log:
+    finished_obs = [ field for field in existing_obs.values() \
+                        if field.submit_status not in scheduler_api.LIVE_STATES ]
+    for field in finished_obs:
+        del existing_obs[field.name]
+    
+    # Assign those fields which are not pinned to a particular telescope,
+    # accounting for the time already requested from each:
+    planner = site_planner.SitePlanner( script_config )
+    new_fields = []
+    for target_name, field in target_fields.items():
+        if field.name in existing_obs.keys() and \
+            existing_obs[field.name].submit_status in scheduler_api.LIVE_STATES:
+            planner.add_load( existing_obs[field.name], \
+                        hours=field.calc_request_hours( script_config ) )
+        else:
+            new_fields.append( field )
+    unassigned = set()
+    for field in planner.plan( new_fields, log=log ):
+        unassigned.add( field.name )
+    
     # Build observing requests and submit, excluding any fields for which
     # live observation requests should already be in the scheduler:
+    deferred_obs = log_utilities.read_deferred_obs( script_config )
+    target_names = sorted( target_fields.keys(), \
+                            key=lambda name: name not in deferred_obs )
     obsrecord = log_utilities.start_obs_record( script_config )
-    for target_name, field in target_fields.items():
+    deferred_log = log_utilities.start_deferred_obs( script_config )
+    journal = log_utilities.start_journal( script_config )
+    batcher = scheduler_api.RequestBatcher( script_config, log, budget )
+    for target_name in target_names:
+        field = target_fields[target_name]
         
-        if field.name not in existing_obs.keys():
-            field.build_odin_request( script_config, log=log, debug=False )
-            log.info('Built observation request ' + field.group_id)
-            
-            field.submit_request(script_config, log=log, debug=False)
-            
-            log.info('    => Status: ' + repr(field.submit_status) + \
-                                ': ' + repr(field.submit_response))
-            obsrecord.write( field.obs_record( script_config ) )
-            existing_obs[field.name] = field
+        if field.name in existing_obs.keys() and \
+            existing_obs[field.name].submit_status in scheduler_api.LIVE_STATES:
+            log.info('Existing live observation request for field ' + \
+                field.name + ' - no additional request made')
+        elif field.name in unassigned:
+            log.info('No telescope assigned to field ' + field.name + \
+                ' - no request made')
+        elif budget.expired():
+            deferred_log.write( field.name + ' budget_expired\n' )
         else:
+            submitted = submit_field( field, batcher, script_config, log )
+            record_submissions( submitted, obsrecord, deferred_log, \
+                                    journal, script_config, log )
+            existing_obs[field.name] = field
+    record_submissions( batcher.flush(), obsrecord, deferred_log, \
+                                    journal, script_config, log )
+    log.info( batcher.summary() )
+    obsrecord.close()
+    log_utilities.close_deferred_obs( deferred_log, script_config, log )
+    
+    # Record active obs groups in the ActiveSurvey log, after which the
+    # journal of this run's submissions is no longer needed:
+    log_utilities.write_active_survey_obs( existing_obs, script_config, log, \
+                                            finished_obs=finished_obs )
+    log_utilities.clear_journal( journal, script_config, log )
+
+def stream_survey( script_config, log, budget ):
+    """Function to build and submit observation requests for the survey 
+    fields in streaming mode.  Only the names of fields with live requests
+    are held in memory; each field read from the target list is built, 
+    submitted and recorded before the next is read, and the records of live
+    requests are copied directly from the old to the new active log.
+    Deferred fields are handled as for submit_survey.
+    """
+    
+    batch_size = int(script_config.get('status_batch_size', 50))
+    live_fields = set()
+    planner = site_planner.SitePlanner( script_config )
+    active_log = log_utilities.start_active_survey_obs( script_config )
+    
+    # Copy the pre-existing live obs requests to the new active log in 
+    # batches, updating their status from the scheduler.  These include any
+    # submissions journaled by a previous run which was interrupted.  
+    # Batches follow the ranges of request IDs in which their status is 
+    # queried, so that each can be cached from one run to the next.  The
+    # status cache is shared by all batches and written once they are done:
+    status_cache = scheduler_api.StatusCache( script_config )
+    batch = []
+    batch_key = None
+    for field in chain( log_utilities.iter_active_survey_obs( script_config, log ),
+                        log_utilities.iter_journal( script_config, log ) ):
+        # The lines recording each request are kept in the same batch:
+        field_key = scheduler_api.get_status_batch( field.req_id, batch_size )
+        if field_key != batch_key or ( len(batch) >= batch_size and \
+                                    field.req_id != batch[-1].req_id ):
+            record_active_batch( batch, live_fields, active_log, planner, \
+                            status_cache, script_config, log, budget )
+            batch = []
+            batch_key = field_key
+        batch.append( field )
+    record_active_batch( batch, live_fields, active_log, planner, \
+                            status_cache, script_config, log, budget )
+    status_cache.write()
+    
+    deferred_obs = log_utilities.read_deferred_obs( script_config )
+    obsrecord = log_utilities.start_obs_record( script_config )
+    deferred_log = log_utilities.start_deferred_obs( script_config )
+    journal = log_utilities.start_journal( script_config )
+    batcher = scheduler_api.RequestBatcher( script_config, log, budget )
+    
+    # Fields which are not pinned to a telescope are assigned as they are 
+    # read, so the load is balanced greedily in the order of the target list:
+    for field in iter_prioritised_targets( script_config, log, deferred_obs ):
+        
+        if field.name in live_fields:
             log.info('Existing live observation request for field ' + \
                 field.name + ' - no additional request made')
+        elif budget.expired():
+            deferred_log.write( field.name + ' budget_expired\n' )
+        elif planner.assign( field ) == False:
+            log.info('No telescope assigned to field ' + field.name + \
+                ' - no request made')
+        else:
+            submitted = submit_field( field, batcher, script_config, log )
+            record_submissions( submitted, obsrecord, deferred_log, \
+                            journal, script_config, log, active_log=active_log )
+            live_fields.add( field.name )
+    record_submissions( batcher.flush(), obsrecord, deferred_log, \
+                            journal, script_config, log, active_log=active_log )
+    log.info( batcher.summary() )
     obsrecord.close()
+    log_utilities.close_deferred_obs( deferred_log, script_config, log )
     
-    # Record active obs groups in the ActiveSurvey log:
-    log_utilities.write_active_survey_obs( existing_obs, script_config, log )
+    log_utilities.close_active_survey_obs( active_log, script_config, log )
+    log_utilities.clear_journal( journal, script_config, log )
+
+def record_active_batch( batch, live_fields, active_log, planner, 
+                            status_cache, script_config, log, budget ):
+    """Function to synchronise the status of a batch of existing obs
+    requests and output them to the active log, noting the names of those
+    which remain live and adding them to the load of the planner.
+    Each request is recorded by one line per exposure, which are combined
+    so that the request is added to the load once."""
     
-    # Tidy up and finish:
-    log.info('Finished requesting observations')
-    lock( script_config, 'unlock', log )
-    log_utilities.end_day_log( log )
+    if len(batch) == 0:
+        return
+    scheduler_api.sync_request_status( batch, script_config, log, \
+                                    budget=budget, cache=status_cache )
+    live_requests = {}
+    for field in batch:
+        active_log.write( field.obs_record( script_config ) )
+        if field.submit_status in scheduler_api.LIVE_STATES:
+            live_fields.add( field.name )
+            request_key = ( field.name, field.group_id )
+            if request_key not in live_requests:
+                live_requests[request_key] = field
+            else:
+                request = live_requests[request_key]
+                request.exposure_times.extend( field.exposure_times )
+                request.exposure_counts.extend( field.exposure_counts )
+    for request in live_requests.values():
+        planner.add_load( request )
+
+def submit_field( field, batcher, script_config, log ):
+    """Function to build the observation request for a single survey field
+    and pass it to the batcher for submission.  Returns the list of fields 
+    submitted as a result."""
+    
+    field.build_odin_request( script_config, log=log, debug=False )
+    log.info('Built observation request ' + field.group_id)
+    
+    return batcher.submit( field )
+
+def record_submissions( fields, obsrecord, deferred_log, journal, 
+                            script_config, log, active_log=None ):
+    """Function to record a list of submitted fields in the log, the 
+    journal, the obsrecord and, optionally, the active log.  Fields which 
+    could not be submitted are deferred to the next run.  The serialized 
+    requests are released once recorded."""
+    
+    for field in fields:
+        log.info('    => ' + field.name + ' Status: ' + \
+                repr(field.submit_status) + ': ' + \
+                repr(field.submit_response))
+        log_utilities.journal_submission( journal, field, script_config )
+        field.json_request = None
+        obsrecord.write( field.obs_record( script_config ) )
+        if active_log != None:
+            active_log.write( field.obs_record( script_config ) )
+        if field.submit_status == 'NOT_SUBMITTED':
+            if 'budget' in str(field.submit_response):
+                deferred_log.write( field.name + ' budget_expired\n' )
+            else:
+                deferred_log.write( field.name + ' network_error\n' )
 
 def lock( config, state, log ):
     """Method to create and release this script's lockfile and also to determine
     whether another lock file exists which may prevent this script operating.    
+    A survey.lock left by an interrupted run is removed, so that the next 
+    run can replay its journal.
     """
 
     lock_file = path.join( config['logdir'], 'survey.lock' )    
@@ -79,7 +282,7 @@ def lock( config, state, log ):
     if state == 'lock':
         lock = open(lock_file,'w')
         ts = datetime.utcnow()
-        lock.write( ts.strftime("%Y-%m-%dT%H:%M:%S") )
+        lock.write( ts.strftime("%Y-%m-%dT%H:%M:%S") + ' ' + str(getpid()) )
         lock.close()
         log.info('Created lock file')
     
@@ -92,6 +295,11 @@ def lock( config, state, log ):
         lock_list = [ 'obscontrol.lock', 'survey.lock' ]
         for lock_name in lock_list:
             lock_file = path.join( config['logdir'],lock_name )
+            if lock_name == 'survey.lock' and path.isfile( lock_file ) == True \
+                and is_stale_lock( lock_file, config ) == True:
+                log.info('Removing stale lock file ( ' + lock_name + \
+                                ' ) left by an interrupted run')
+                remove( lock_file )
             if path.isfile( lock_file ) == True:
                 log.info('Clashing lock file encountered ( ' + lock_name + \
                                 ' ), halting')
@@ -99,10 +307,52 @@ def lock( config, state, log ):
                 exit()
         log.info('Checked for clashing locks; found none')
         
+def is_stale_lock( lock_file, config ):
+    """Function to determine whether a lock file was left by a run which did
+    not complete.  A lock recording the process which created it is stale 
+    only if that process is no longer running; one which does not is stale 
+    if older than stale_lock_age seconds (default twice the 
+    run_time_budget).  Lock files in any other format are never stale."""
+    
+    entries = open( lock_file, 'r' ).read().split()
+    try:
+        ts = datetime.strptime( entries[0], "%Y-%m-%dT%H:%M:%S" )
+    except (IndexError, ValueError):
+        return False
+    
+    if len(entries) > 1 and entries[1].isdigit():
+        try:
+            kill( int(entries[1]), 0 )
+        except OSError as err:
+            return err.errno == errno.ESRCH
+        return False
+    
+    max_age = float( config.get( 'stale_lock_age', \
+                    2.0 * float(config.get('run_time_budget', 1800.0)) ) )
+    return ( datetime.utcnow() - ts ).total_seconds() > max_age
+
 def read_target_list( script_config, log ):
     """Function to parse the list of field pointings to be surveyed and the
     observation sequence to be done at each pointing"""
     
+    target_fields = {}
+    for field in iter_target_list( script_config, log ):
+        target_fields[field.name] = field
+    
+    return target_fields
+
+def iter_target_list( script_config, log ):
+    """Function to open the list of field pointings to be surveyed, returning
+    a generator which yields each field in turn as the file is read"""
+    
+    target_list = open_target_list( script_config, log )
+    
+    return parse_target_lines( target_list, script_config )
+
+def open_target_list( script_config, log ):
+    """Function to open the list of field pointings to be surveyed, checking
+    its header.  Returns the open file, positioned after the header line."""
+    
     target_file = path.join( script_config['logdir'], script_config['targetlist'] )
     if path.isfile( target_file ) == False:
         log.info('ERROR: Cannot find target list file ' + target_file)
@@ -110,16 +360,54 @@ def read_target_list( script_config, log ):
         log_utilities.end_day_log( log )
         exit()
     
-    file_lines = open( target_file, 'r' ).readlines()
-
-    target_fields = {}
-    if file_lines[0].lstrip()[0:1] != '#':
+    target_list = open( target_file, 'r' )
+    
+    if target_list.readline().lstrip()[0:1] != '#':
         log.info('ERROR: Improperly formatted TargetList file; need header parameters')
         log_utilities.end_day_log( log )
         exit()
-        
-    for line in file_lines[1:]:
-        if line.lstrip()[0:1] != '#':
+    
+    return target_list
+
+def check_target_list( script_config, log ):
+    """Function to validate the complete list of field pointings to be
+    surveyed.  All problems found are reported together, and if any are 
+    errors no observations are requested."""
+    
+    target_list = open_target_list( script_config, log )
+    (errors, warnings) = target_validation.validate_target_lines( target_list, \
+                                                            script_config )
+    target_list.close()
+    
+    for message in warnings:
+        log.info('WARNING: TargetList ' + message)
+    if len(errors) > 0:
+        for message in errors:
+            log.info('ERROR: TargetList ' + message)
+        log.info('HALTING: ' + str(len(errors)) + \
+                    ' errors found in the TargetList; no observations requested')
+        lock( script_config, 'unlock', log )
+        log_utilities.end_day_log( log )
+        exit()
+    log.info('Checked TargetList; found no errors')
+
+def iter_prioritised_targets( script_config, log, deferred_obs ):
+    """Generator function to read the target list, yielding the fields 
+    named in deferred_obs first, followed by all other fields"""
+    
+    if len(deferred_obs) > 0:
+        for field in iter_target_list( script_config, log ):
+            if field.name in deferred_obs:
+                yield field
+    for field in iter_target_list( script_config, log ):
+        if field.name not in deferred_obs:
+            yield field
+
+def parse_target_lines( target_list, script_config ):
+    """Generator function to parse the lines of a target list file"""
+    
+    for line in target_list:
+        if line.lstrip()[0:1] != '#' and len(line.strip()) > 0:
             field = survey_classes.SurveyField(script_config)
             entries = line.replace('#','').replace('\n','').split()
             field.name = entries[0]
@@ -137,10 +425,9 @@ def read_target_list( script_config, log ):
             for nexp in nexp_list:
                 field.exposure_counts.append( int(nexp) )
             field.cadence = float(entries[10])
-
-            target_fields[field.name] = field
-    
-    return target_fields
+            
+            yield field
+    target_list.close()
 
 if __name__ == '__main__':
     run_survey()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:44:48 2026
+"""
+
+#############################################################################
+#                       SITE PLANNER
+#
+# Assignment of survey fields to sites and telescopes of the LCOGT network,
+# balancing the telescope time requested from each
+#############################################################################
+
+class SitePlanner:
+    """Class describing the load of telescope time requested from each of
+    the telescopes available to the survey, and assigning fields to them.
+    
+    The available telescopes are given by the site_list configuration 
+    parameter, as a comma-separated list of site:observatory:tel entries, 
+    e.g. lsc:doma:1m0a,cpt:domc:1m0a.  Fields with site 'any' in the 
+    TargetList may be assigned to any available telescope of the same 
+    class as their tel; all other fields are pinned to the given telescope.
+    """
+    
+    def __init__(self, config):
+        self.config = config
+        self.telescopes = []
+        self.load = {}
+        self.classes = {}
+        
+        for entry in str(config.get('site_list','')).split(','):
+            if len(entry.strip()) > 0:
+                components = entry.strip().split(':')
+                if len(components) != 3 or '' in components:
+                    raise ValueError('Invalid site_list entry ' + \
+                        entry.strip() + ', expected site:observatory:tel')
+                (site, observatory, tel) = components
+                telescope = ( site, observatory, self.get_tel_class(tel) )
+                self.telescopes.append( telescope )
+                self.load[telescope] = 0.0
+                if telescope[2] not in self.classes:
+                    self.classes[telescope[2]] = []
+                self.classes[telescope[2]].append( telescope )
+    
+    def summary(self):
+        output = ''
+        for telescope in sorted( self.load.keys() ):
+            output = output + ':'.join(telescope) + '=' + \
+                        str(round(self.load[telescope],2)) + 'hrs '
+        return output.strip()
+    
+    def is_pinned(self, field):
+        return str(field.site).lower() != 'any'
+    
+    def add_load(self, field, hours=None):
+        """Method to add the telescope time requested by a pinned field,
+        or a live request, to the load on its telescope"""
+        
+        if hours == None:
+            hours = field.calc_request_hours( self.config )
+        tel_class = self.get_tel_class( field.tel )
+        telescope = ( str(field.site), str(field.observatory), tel_class )
+        self.load[telescope] = self.load.get(telescope, 0.0) + hours
+    
+    def get_tel_class(self, tel):
+        return str(tel).lower().replace('a','')
+    
+    def assign(self, field, hours=None):
+        """Method to assign a field which is not pinned to the least loaded
+        telescope of its class, adding its requested time to the load.  
+        Pinned fields are added to the load of their own telescope.
+        Returns False if no telescope is available, in which case the field 
+        is unchanged."""
+        
+        if hours == None:
+            hours = field.calc_request_hours( self.config )
+        if self.is_pinned( field ):
+            self.add_load( field, hours=hours )
+            return True
+        
+        # The site_list holds only a handful of telescopes of each class,
+        # so the least loaded is found directly:
+        telescopes = self.classes.get( self.get_tel_class( field.tel ), [] )
+        if len(telescopes) == 0:
+            return False
+        telescope = min( telescopes, key=lambda t: ( self.load[t], t ) )
+        (field.site, field.observatory) = telescope[0:2]
+        self.load[telescope] = self.load[telescope] + hours
+        return True
+    
+    def plan(self, fields, log=None):
+        """Method to assign a list of fields to telescopes.  The load from 
+        pinned fields is accounted for first, then the remaining fields are 
+        assigned in order of decreasing requested time to the least loaded 
+        telescope of their class.  Returns the list of fields for which no
+        telescope was available."""
+        
+        flexible = []
+        unassigned = []
+        for field in fields:
+            if self.is_pinned( field ):
+                self.add_load( field )
+            else:
+                flexible.append( ( field.calc_request_hours( self.config ), \
+                                    field ) )
+        flexible.sort( key=lambda entry: entry[0], reverse=True )
+        
+        for (hours, field) in flexible:
+            status = self.assign( field, hours=hours )
+            if status == False:
+                unassigned.append( field )
+                if log != None:
+                    log.info('WARNING: No telescope of class ' + str(field.tel) + \
+                        ' available for field ' + str(field.name))
+        
+        if log != None:
+            log.info('Assigned ' + str(len(flexible)-len(unassigned)) + \
+                    ' fields to telescopes; requested load: ' + self.summary())
+        return unassigned
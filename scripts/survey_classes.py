@@ -6,11 +6,14 @@ Created on Wed Mar 16 15:24:24 2016
 """
 
 from datetime import datetime, timedelta
-import urllib
+from math import ceil
 import utilities
 import instruments
 import json
 import httplib
+import socket
+import time
+import scheduler_api
 from sys import exit
 
 class SurveyField:
@@ -114,7 +117,25 @@ class SurveyField:
         self.submit_mech = entries[30]
         self.config_type = entries[31]
         self.req_origin = entries[32]
-        self.submit_status = entries[33]
+        self.submit_status = entries[33].rstrip(':')
+    
+    def calc_request_hours(self, config):
+        """Method to estimate the telescope time, in hours, requested by a 
+        single submission of this field's observation request, following the
+        sequence of windows generated by build_odin_request"""
+        
+        imager = instruments.Instrument(self.tel, self.instrument)
+        group_length = 0.0
+        for i,exptime in enumerate(self.exposure_times):
+            nexp = self.exposure_counts[i]
+            group_length = group_length + imager.calc_group_length( nexp, exptime )
+        
+        window = float(config['request_window']) * 60.0 * 60.0
+        request_interval = imager.calc_group_length( nexp, exptime ) + \
+                    window + ( float(self.cadence)*24.0*60.0*60.0 )
+        nwindows = ceil( (float(self.ttl)*24.0*60.0*60.0) / request_interval )
+        
+        return ( nwindows * group_length ) / ( 60.0 * 60.0 )
     
     def build_odin_request(self, config, log=None, debug=False):
         
@@ -220,7 +241,13 @@ class SurveyField:
         if debug == True and log != None:
             log.info(' -> Completed build of observation request')
     
-    def submit_request(self, config, log=None, debug=False):
+    def submit_request(self, config, log=None, debug=False, budget=None):
+        """Method to submit the observation request to the scheduler.  
+        If the submission fails due to a network error or timeout, the
+        submit_status is set to NOT_SUBMITTED, or to SUBMIT_UNKNOWN if the
+        request had already been sent.  If a RunBudget is given, 
+        its deadlines apply and the latency of the submission is recorded.
+        """
         
         params = {'username': config['user_id'] ,
                   'password': config['odin_access'], 
@@ -236,16 +263,27 @@ class SurveyField:
             log.info(' -> IN SIMULATION MODE: ' + self.submit_status)
             
         else:
-            url_request = urllib.urlencode(params)
-            headers = {'Content-type': 'application/x-www-form-urlencoded'}
+            ts_start = time.time()
+            try:
+                submit_string = scheduler_api.post_submission( params, \
+                                                        config, budget=budget )
+                
+                self.parse_submit_response( submit_string, log=log, debug=debug )
+            
+            except (socket.error, httplib.HTTPException) as err:
+                self.submit_status = 'NOT_SUBMITTED'
+                self.submit_response = 'Network error: ' + repr(err)
+                log.info(' -> WARNING: Submission failed: ' + \
+                                        self.submit_response)
             
-            secure_connect = httplib.HTTPSConnection("lcogt.net") 
-            secure_connect.request("POST", "/observe/service/request/submit", 
-                                               url_request, headers)
-            submit_string = secure_connect.getresponse().read()	
+            except scheduler_api.SubmitOutcomeUnknown as err:
+                self.submit_status = 'SUBMIT_UNKNOWN'
+                self.submit_response = str(err)
+                log.info(' -> WARNING: Outcome of submission of group ' + \
+                        str(self.group_id) + ' unknown: ' + self.submit_response)
             
-            self.parse_submit_response( submit_string, log=log, debug=debug )
-            secure_connect.close()
+            if budget != None:
+                budget.record_latency( time.time() - ts_start )
         log.info(' -> Completed obs submission')
         
     def parse_submit_response( self, submit_string, log=None, debug=False ):
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:46:14 2026
+"""
+
+#############################################################################
+#                       TARGET VALIDATION
+#
+# Pre-flight checks of the survey TargetList, made in full before any
+# observation requests are submitted
+#############################################################################
+
+import numpy as np
+from itertools import chain
+import instruments
+import site_planner
+import survey_classes
+
+# Number of columns required for each field in the TargetList:
+NCOLUMNS = 11
+
+def parse_sexig( coord_str ):
+    """Function to convert a sexigesimal coordinate string into a decimal
+    float, as for utilities.sexig2dec, but returning NaN rather than 0 if
+    the string is not a valid coordinate"""
+
+    coord_str = coord_str.strip().replace(' ',':')
+    sign = 1.0
+    if coord_str[0:1] == '-':
+        sign = -1.0
+        coord_str = coord_str[1:]
+    elif coord_str[0:1] == '+':
+        coord_str = coord_str[1:]
+
+    components = coord_str.split(':')
+    if len(components) != 3:
+        return np.nan
+    try:
+        (deg, mins, secs) = [ float(x) for x in components ]
+    except ValueError:
+        return np.nan
+    if deg < 0.0 or mins < 0.0 or mins >= 60.0 or secs < 0.0 or secs >= 60.0:
+        return np.nan
+
+    return sign * ( deg + (mins/60.0) + (secs/3600.0) )
+
+def to_float_array( strings ):
+    """Function to convert a list of strings to an array of floats, with
+    NaN entries for any which are not valid numbers"""
+
+    try:
+        values = np.array( strings, dtype=float )
+    except ValueError:
+        values = np.empty( len(strings) )
+        for i,entry in enumerate(strings):
+            try:
+                values[i] = float(entry)
+            except ValueError:
+                values[i] = np.nan
+    return values
+
+def validate_target_lines( target_list, config, chunk_size=10000 ):
+    """Function to check the lines of a target list file, following its
+    header line.  The fields are checked in chunks of chunk_size lines,
+    so that the memory used does not depend on the length of the list.
+    Returns lists of (errors, warnings), each entry describing a problem
+    with a particular line.
+    """
+
+    errors = []
+    warnings = []
+    names = set()
+
+    ttl = float(survey_classes.SurveyField(config).ttl)
+
+    tel_classes = set()
+    try:
+        for telescope in site_planner.SitePlanner(config).telescopes:
+            tel_classes.add( telescope[2] )
+    except ValueError as err:
+        errors.append( ( 0, str(err) ) )
+        tel_classes = None
+
+    chunk = []
+    for line_number, line in enumerate( target_list, 2 ):
+        if line.lstrip()[0:1] == '#' or len(line.strip()) == 0:
+            continue
+        entries = line.replace('#','').split()
+        if len(entries) < NCOLUMNS:
+            errors.append( ( line_number, 'Expected ' + str(NCOLUMNS) + \
+                        ' columns, found ' + str(len(entries)) ) )
+            continue
+        if entries[0] in names:
+            errors.append( ( line_number, 'Duplicate field name ' + entries[0] ) )
+        names.add( entries[0] )
+
+        chunk.append( ( line_number, entries ) )
+        if len(chunk) >= chunk_size:
+            check_target_chunk( chunk, ttl, tel_classes, errors, warnings )
+            chunk = []
+    check_target_chunk( chunk, ttl, tel_classes, errors, warnings )
+
+    errors.sort()
+    warnings.sort()
+    return format_problems( errors ), format_problems( warnings )
+
+def format_problems( problems ):
+    output = []
+    for ( line_number, message ) in problems:
+        if line_number > 0:
+            output.append( 'Line ' + str(line_number) + ': ' + message )
+        else:
+            output.append( message )
+    return output
+
+def check_target_chunk( chunk, ttl, tel_classes, errors, warnings ):
+    """Function to check a chunk of TargetList entries, each given as a
+    tuple of (line_number, entries), appending any problems found to the
+    lists of errors and warnings"""
+
+    if len(chunk) == 0:
+        return
+    
+    # Invalid entries are represented by NaN, which fail every check:
+    np_errors = np.seterr( invalid='ignore' )
+
+    line_numbers = np.array( [ c[0] for c in chunk ] )
+    columns = zip( *[ c[1][0:NCOLUMNS] for c in chunk ] )
+    names = np.array( columns[0] )
+
+    def report( problems, select, message ):
+        for i in np.nonzero( select )[0]:
+            problems.append( ( int(line_numbers[i]), \
+                                'Field ' + names[i] + ': ' + message ) )
+
+    # Coordinates:
+    ra = np.array( [ parse_sexig(x) for x in columns[1] ] ) * 15.0
+    dec = np.array( [ parse_sexig(x) for x in columns[2] ] )
+    report( errors, ~( ( ra >= 0.0 ) & ( ra < 360.0 ) ), \
+                    'Invalid RA, expected HH:MM:SS.S in the range 0-24hrs' )
+    report( errors, ~( np.abs(dec) <= 90.0 ), \
+                    'Invalid Dec, expected DD:MM:SS.S in the range +/-90deg' )
+
+    # Telescope and instrument combinations, checked once for each
+    # unique combination:
+    combos = np.char.add( np.char.add( np.char.lower( columns[5] ), ' ' ), \
+                            np.char.lower( columns[6] ) )
+    (unique_combos, inverse) = np.unique( combos, return_inverse=True )
+    known = np.array( [ instruments.is_known_instrument( *c.split(' ') ) \
+                            for c in unique_combos ] )
+    report( errors, ~known[inverse], 'Unknown telescope/instrument combination' )
+
+    # Fields which are not pinned to a telescope need one of their
+    # class to be available, if the site_list could be read:
+    if tel_classes != None:
+        sites = np.char.lower( columns[3] )
+        tels = np.char.replace( np.char.lower( columns[5] ), 'a', '' )
+        available = np.array( [ tel in tel_classes for tel in tels ] )
+        report( errors, ( sites == 'any' ) & ~available, \
+                    'No telescope of this class available in the site_list' )
+
+    # Exposure sequences.  The exposure times and counts for all fields
+    # are checked together, then reduced to one result per field:
+    exptime_lists = [ x.split(',') for x in columns[8] ]
+    count_lists = [ x.split(',') for x in columns[9] ]
+    nexptimes = np.array( [ len(x) for x in exptime_lists ] )
+    ncounts = np.array( [ len(x) for x in count_lists ] )
+    report( errors, nexptimes != ncounts, \
+                    'Mismatched numbers of exposure times and counts' )
+
+    exptimes = to_float_array( list( chain( *exptime_lists ) ) )
+    counts = np.array( list( chain( *count_lists ) ) )
+    good_exptimes = np.minimum.reduceat( np.isfinite(exptimes) & \
+                            ( exptimes > 0.0 ), \
+                            np.cumsum(nexptimes) - nexptimes )
+    good_counts = np.minimum.reduceat( np.char.isdigit(counts) & \
+                            ( to_float_array(counts) >= 1.0 ), \
+                            np.cumsum(ncounts) - ncounts )
+    report( errors, ~good_exptimes, 'Exposure times must be positive numbers' )
+    report( errors, ~good_counts, 'Exposure counts must be positive integers' )
+
+    # Cadence:
+    cadence = to_float_array( list(columns[10]) )
+    report( errors, ~( np.isfinite(cadence) & ( cadence >= 0.0 ) ), \
+                    'Cadence must be a non-negative number of days' )
+    report( warnings, cadence > ttl, \
+                    'Cadence exceeds the request TTL of ' + str(ttl) + \
+                    ' days; only one window will be requested per submission' )
+    
+    np.seterr( **np_errors )